@@ -8,6 +8,8 @@ usage:
     SortImports(file_name)
 or:
     sorted = SortImports(file_contents=file_contents).output
+or, to only sort the import block around a given line:
+    start, end, sorted = sort_range(file_contents, line_number)
 
 Copyright (C) 2013  Timothy Edmund Crosley
 
@@ -38,18 +40,32 @@ from __future__ import unicode_literals
 
 import argparse
 import codecs
-import copy
+import fnmatch
 import io
 import itertools
+import json
 import os
 import os.path
+import re
+import subprocess
 import sys
+import tarfile
+import time
+import zipfile
+import zlib
 from collections import namedtuple
 from difflib import unified_diff
+from functools import partial
 from sys import path as PYTHONPATH
 from sys import stderr
 from sys import stdout
 
+try:
+    import asyncio
+    from concurrent.futures import ThreadPoolExecutor
+except ImportError:
+    asyncio = None
+
 __version__ = '2.6.0'
 
 
@@ -65,37 +81,150 @@ WrapModes = (
     'VERTICAL_GRID_GROUPED')
 WrapModes = namedtuple('WrapModes', WrapModes)(*range(len(WrapModes)))
 
+ARCHIVE_EXTENSIONS = ('.whl', '.zip', '.tar', '.tar.gz', '.tgz', '.tar.bz2')
+
+# Standard library tables for every supported target version, generated from the builtin modules, standard library
+# directories (including Python 2's lib-tk and plat-linux2) and (from 3.10) sys.stdlib_module_names of each
+# interpreter. Modules a build only reports on when it was built for their platform or had their optional
+# dependencies available (Windows and macOS modules, dbm, gdbm, _bsddb, _hashlib, ...) were added by hand, since
+# earlier versions have no sys.stdlib_module_names to list them. Each Python 3 version is listed as the modules it
+# added and removed.
+PYTHON2_STANDARD_LIBRARY = frozenset([
+    '__builtin__', '__future__', '__main__', '__phello__', '_abcoll', '_ast', '_bisect', '_bsddb', '_codecs',
+    '_codecs_cn', '_codecs_hk', '_codecs_iso2022', '_codecs_jp', '_codecs_kr', '_codecs_tw', '_collections', '_csv',
+    '_ctypes', '_ctypes_test', '_curses', '_curses_panel', '_elementtree', '_functools', '_hashlib', '_heapq',
+    '_hotshot', '_io', '_json', '_locale', '_lsprof', '_LWPCookieJar', '_md5', '_MozillaCookieJar', '_msi',
+    '_multibytecodec', '_multiprocessing', '_osx_support', '_pyio', '_random', '_scproxy', '_sha', '_sha256', '_sha512',
+    '_socket', '_sqlite3', '_sre', '_ssl', '_strptime', '_struct', '_subprocess', '_symtable', '_sysconfigdata',
+    '_testcapi', '_threading_local', '_tkinter', '_warnings', '_weakref', '_weakrefset', '_winreg', 'abc', 'aifc',
+    'antigravity', 'anydbm', 'argparse', 'array', 'ast', 'asynchat', 'asyncore', 'atexit', 'audiodev', 'audioop',
+    'base64', 'BaseHTTPServer', 'Bastion', 'bdb', 'binascii', 'binhex', 'bisect', 'bsddb', 'bz2', 'calendar', 'Canvas',
+    'CDROM', 'cgi', 'CGIHTTPServer', 'cgitb', 'chunk', 'cmath', 'cmd', 'code', 'codecs', 'codeop', 'collections',
+    'colorsys', 'commands', 'compileall', 'compiler', 'ConfigParser', 'contextlib', 'Cookie', 'cookielib', 'copy',
+    'copy_reg', 'cPickle', 'cProfile', 'crypt', 'cStringIO', 'csv', 'ctypes', 'curses', 'datetime', 'dbhash', 'dbm',
+    'decimal', 'Dialog', 'difflib', 'dircache', 'dis', 'distutils', 'dl', 'DLFCN', 'doctest', 'DocXMLRPCServer',
+    'dumbdbm', 'dummy_thread', 'dummy_threading', 'email', 'encodings', 'ensurepip', 'errno', 'exceptions', 'fcntl',
+    'filecmp', 'FileDialog', 'fileinput', 'FixTk', 'fnmatch', 'formatter', 'fpformat', 'fractions', 'ftplib',
+    'functools', 'future_builtins', 'gc', 'gdbm', 'genericpath', 'getopt', 'getpass', 'gettext', 'glob', 'grp', 'gzip',
+    'hashlib', 'heapq', 'hmac', 'hotshot', 'htmlentitydefs', 'htmllib', 'HTMLParser', 'httplib', 'idlelib', 'ihooks',
+    'imageop', 'imaplib', 'imghdr', 'imp', 'importlib', 'imputil', 'IN', 'inspect', 'io', 'itertools', 'json',
+    'keyword', 'lib2to3', 'linecache', 'linuxaudiodev', 'locale', 'logging', 'macpath', 'macurl2path', 'mailbox',
+    'mailcap', 'markupbase', 'marshal', 'math', 'md5', 'mhlib', 'mimetools', 'mimetypes', 'MimeWriter', 'mimify',
+    'mmap', 'modulefinder', 'msilib', 'msvcrt', 'multifile', 'multiprocessing', 'mutex', 'netrc', 'new', 'nis',
+    'nntplib', 'nt', 'ntpath', 'nturl2path', 'numbers', 'opcode', 'operator', 'optparse', 'os', 'os2emxpath',
+    'ossaudiodev', 'parser', 'pdb', 'pickle', 'pickletools', 'pipes', 'pkgutil', 'platform', 'plistlib', 'popen2',
+    'poplib', 'posix', 'posixfile', 'posixpath', 'pprint', 'profile', 'pstats', 'pty', 'pwd', 'py_compile', 'pyclbr',
+    'pydoc', 'pydoc_data', 'pyexpat', 'Queue', 'quopri', 'random', 're', 'readline', 'repr', 'resource', 'rexec',
+    'rfc822', 'rlcompleter', 'robotparser', 'runpy', 'sched', 'ScrolledText', 'select', 'sets', 'sgmllib', 'sha',
+    'shelve', 'shlex', 'shutil', 'signal', 'SimpleDialog', 'SimpleHTTPServer', 'SimpleXMLRPCServer', 'site', 'smtpd',
+    'smtplib', 'sndhdr', 'socket', 'SocketServer', 'spwd', 'sqlite3', 'sre', 'sre_compile', 'sre_constants',
+    'sre_parse', 'ssl', 'stat', 'statvfs', 'string', 'StringIO', 'stringold', 'stringprep', 'strop', 'struct',
+    'subprocess', 'sunau', 'sunaudio', 'symbol', 'symtable', 'sys', 'sysconfig', 'syslog', 'tabnanny', 'tarfile',
+    'telnetlib', 'tempfile', 'termios', 'test', 'textwrap', 'this', 'thread', 'threading', 'time', 'timeit', 'Tix',
+    'tkColorChooser', 'tkCommonDialog', 'Tkconstants', 'Tkdnd', 'tkFileDialog', 'tkFont', 'Tkinter', 'tkMessageBox',
+    'tkSimpleDialog', 'toaiff', 'token', 'tokenize', 'trace', 'traceback', 'ttk', 'tty', 'turtle', 'TYPES', 'types',
+    'unicodedata', 'unittest', 'urllib', 'urllib2', 'urlparse', 'user', 'UserDict', 'UserList', 'UserString', 'uu',
+    'uuid', 'warnings', 'wave', 'weakref', 'webbrowser', 'whichdb', 'winsound', 'wsgiref', 'xdrlib', 'xml', 'xmllib',
+    'xmlrpclib', 'xxsubtype', 'zipfile', 'zipimport', 'zlib'])
+_PYTHON3_STANDARD_LIBRARY_CHANGES = (
+    ('3.6',
+     frozenset([
+         '__future__', '__phello__', '_ast', '_asyncio', '_bisect', '_blake2', '_bootlocale', '_bz2', '_codecs',
+         '_codecs_cn', '_codecs_hk', '_codecs_iso2022', '_codecs_jp', '_codecs_kr', '_codecs_tw', '_collections',
+         '_collections_abc', '_compat_pickle', '_compression', '_crypt', '_csv', '_ctypes', '_ctypes_test', '_curses',
+         '_curses_panel', '_datetime', '_dbm', '_decimal', '_dummy_thread', '_elementtree', '_frozen_importlib',
+         '_frozen_importlib_external', '_functools', '_gdbm', '_hashlib', '_heapq', '_imp', '_io', '_json', '_locale',
+         '_lsprof', '_lzma', '_markupbase', '_md5', '_msi', '_multibytecodec', '_multiprocessing', '_opcode',
+         '_operator', '_osx_support', '_overlapped', '_pickle', '_posixsubprocess', '_pydecimal', '_pyio', '_random',
+         '_scproxy', '_sha1', '_sha256', '_sha3', '_sha512', '_signal', '_sitebuiltins', '_socket', '_sqlite3', '_sre',
+         '_ssl', '_stat', '_string', '_strptime', '_struct', '_symtable', '_testbuffer', '_testcapi',
+         '_testimportmultiple', '_testmultiphase', '_thread', '_threading_local', '_tkinter', '_tracemalloc',
+         '_warnings', '_weakref', '_weakrefset', '_winapi', 'abc', 'aifc', 'antigravity', 'argparse', 'array', 'ast',
+         'asynchat', 'asyncio', 'asyncore', 'atexit', 'audioop', 'base64', 'bdb', 'binascii', 'binhex', 'bisect',
+         'builtins', 'bz2', 'calendar', 'cgi', 'cgitb', 'chunk', 'cmath', 'cmd', 'code', 'codecs', 'codeop',
+         'collections', 'colorsys', 'compileall', 'concurrent', 'configparser', 'contextlib', 'copy', 'copyreg',
+         'cProfile', 'crypt', 'csv', 'ctypes', 'curses', 'datetime', 'dbm', 'decimal', 'difflib', 'dis', 'distutils',
+         'doctest', 'dummy_threading', 'email', 'encodings', 'ensurepip', 'enum', 'errno', 'faulthandler', 'fcntl',
+         'filecmp', 'fileinput', 'fnmatch', 'formatter', 'fractions', 'ftplib', 'functools', 'gc', 'genericpath',
+         'getopt', 'getpass', 'gettext', 'glob', 'grp', 'gzip', 'hashlib', 'heapq', 'hmac', 'html', 'http', 'idlelib',
+         'imaplib', 'imghdr', 'imp', 'importlib', 'inspect', 'io', 'ipaddress', 'itertools', 'json', 'keyword',
+         'lib2to3', 'linecache', 'locale', 'logging', 'lzma', 'macpath', 'macurl2path', 'mailbox', 'mailcap', 'marshal',
+         'math', 'mimetypes', 'mmap', 'modulefinder', 'msilib', 'msvcrt', 'multiprocessing', 'netrc', 'nis', 'nntplib',
+         'nt', 'ntpath', 'nturl2path', 'numbers', 'opcode', 'operator', 'optparse', 'os', 'ossaudiodev', 'parser',
+         'pathlib', 'pdb', 'pickle', 'pickletools', 'pipes', 'pkgutil', 'platform', 'plistlib', 'poplib', 'posix',
+         'posixpath', 'pprint', 'profile', 'pstats', 'pty', 'pwd', 'py_compile', 'pyclbr', 'pydoc', 'pydoc_data',
+         'pyexpat', 'queue', 'quopri', 'random', 're', 'readline', 'reprlib', 'resource', 'rlcompleter', 'runpy',
+         'sched', 'secrets', 'select', 'selectors', 'shelve', 'shlex', 'shutil', 'signal', 'site', 'smtpd', 'smtplib',
+         'sndhdr', 'socket', 'socketserver', 'spwd', 'sqlite3', 'sre_compile', 'sre_constants', 'sre_parse', 'ssl',
+         'stat', 'statistics', 'string', 'stringprep', 'struct', 'subprocess', 'sunau', 'symbol', 'symtable', 'sys',
+         'sysconfig', 'syslog', 'tabnanny', 'tarfile', 'telnetlib', 'tempfile', 'termios', 'test', 'textwrap', 'this',
+         'threading', 'time', 'timeit', 'tkinter', 'token', 'tokenize', 'trace', 'traceback', 'tracemalloc', 'tty',
+         'turtle', 'turtledemo', 'types', 'typing', 'unicodedata', 'unittest', 'urllib', 'uu', 'uuid', 'venv',
+         'warnings', 'wave', 'weakref', 'webbrowser', 'winreg', 'winsound', 'wsgiref', 'xdrlib', 'xml', 'xmlrpc',
+         'xxlimited', 'xxsubtype', 'zipapp', 'zipfile', 'zipimport', 'zlib']),
+     frozenset()),
+    ('3.7',
+     frozenset([
+         '_abc', '_contextvars', '_py_abc', '_queue', '_uuid', '_xxtestfuzz', 'contextvars', 'dataclasses']),
+     frozenset([
+         'macurl2path'])),
+    ('3.8',
+     frozenset([
+         '_posixshmem', '_statistics', '_testinternalcapi', '_xxsubinterpreters']),
+     frozenset([
+         'macpath'])),
+    ('3.9',
+     frozenset([
+         '_aix_support', '_bootsubprocess', '_peg_parser', '_zoneinfo', 'graphlib', 'zoneinfo']),
+     frozenset([
+         '_dummy_thread', 'dummy_threading'])),
+    ('3.10',
+     frozenset([
+         '_testclinic', 'xxlimited_35']),
+     frozenset([
+         '_bootlocale', '_peg_parser', 'formatter', 'parser', 'symbol'])),
+    ('3.11',
+     frozenset([
+         '__hello__', '_tokenize', '_typing', 'tomllib']),
+     frozenset([
+         'binhex'])),
+    ('3.12',
+     frozenset([
+         '_pydatetime', '_pylong', '_sha2', '_testsinglephase', '_xxinterpchannels']),
+     frozenset([
+         '_bootsubprocess', '_sha256', '_sha512', 'asynchat', 'asyncore', 'distutils', 'imp', 'smtpd'])),
+    ('3.13',
+     frozenset([
+         '_android_support', '_colorize', '_interpchannels', '_interpqueues', '_interpreters', '_ios_support',
+         '_opcode_metadata', '_pyrepl', '_suggestions', '_sysconfig', '_testclinic_limited', '_testexternalinspection',
+         '_testlimitedcapi', '_wmi']),
+     frozenset([
+         '_crypt', '_msi', '_xxinterpchannels', '_xxsubinterpreters', 'aifc', 'audioop', 'cgi', 'cgitb', 'chunk',
+         'crypt', 'imghdr', 'lib2to3', 'mailcap', 'msilib', 'nis', 'nntplib', 'ossaudiodev', 'pipes', 'sndhdr', 'spwd',
+         'sunau', 'telnetlib', 'uu', 'xdrlib'])),
+)
+
+
+def _standard_library_tables():
+    """Returns the standard library table of every version listed in _PYTHON3_STANDARD_LIBRARY_CHANGES."""
+    tables = {'2.7': PYTHON2_STANDARD_LIBRARY}
+    names = frozenset()
+    for version, added, removed in _PYTHON3_STANDARD_LIBRARY_CHANGES:
+        names = (names - removed) | added
+        tables[version] = names
+    return tables
+
+
+STANDARD_LIBRARIES = _standard_library_tables()
+
 # Note that none of these lists must be complete as they are simply
 # fallbacks for when included auto-detection fails.
 default = {'force_to_top': [],
-           'skip': [],
+           'skip': ['.git', '.hg', '.svn', '.tox', '.venv', '__pycache__', 'site-packages'],
+           'include': ['*.py'],
            'line_length': 80,
-           'known_standard_library': [
-               'abc', 'anydbm', 'argparse', 'array', 'asynchat', 'asyncore',
-               'atexit', 'base64', 'BaseHTTPServer', 'bisect', 'bz2',
-               'calendar', 'cgitb', 'cmd', 'codecs', 'collections', 'commands',
-               'compileall', 'ConfigParser', 'contextlib', 'Cookie', 'copy',
-               'cPickle', 'cProfile', 'cStringIO', 'csv', 'datetime', 'dbhash',
-               'dbm', 'decimal', 'difflib', 'dircache', 'dis', 'doctest',
-               'dumbdbm', 'EasyDialogs', 'errno', 'exceptions', 'filecmp',
-               'fileinput', 'fnmatch', 'fractions', 'functools', 'gc', 'gdbm',
-               'getopt', 'getpass', 'gettext', 'glob', 'grp', 'gzip',
-               'hashlib', 'heapq', 'hmac', 'imaplib', 'imp', 'inspect',
-               'itertools', 'json', 'linecache', 'locale', 'logging',
-               'mailbox', 'math', 'mhlib', 'mmap', 'multiprocessing',
-               'operator', 'optparse', 'os', 'pdb', 'pickle', 'pipes',
-               'pkgutil', 'platform', 'plistlib', 'pprint', 'profile',
-               'pstats', 'pwd', 'pyclbr', 'pydoc', 'Queue', 'random', 're',
-               'readline', 'resource', 'rlcompleter', 'robotparser', 'sched',
-               'select', 'shelve', 'shlex', 'shutil', 'signal',
-               'SimpleXMLRPCServer', 'site', 'sitecustomize', 'smtpd',
-               'smtplib', 'socket', 'SocketServer', 'sqlite3', 'string',
-               'StringIO', 'struct', 'subprocess', 'sys', 'sysconfig',
-               'tabnanny', 'tarfile', 'tempfile', 'textwrap', 'threading',
-               'time', 'timeit', 'trace', 'traceback', 'unittest', 'urllib',
-               'urllib2', 'urlparse', 'usercustomize', 'uuid', 'warnings',
-               'weakref', 'webbrowser', 'whichdb', 'xml', 'xmlrpclib',
-               'zipfile', 'zipimport', 'zlib'],
+           'known_standard_library': [],
+           'python_version': None,
            'known_third_party': ['google.appengine.api'],
            'known_first_party': [],
            'multi_line_output': WrapModes.GRID,
@@ -104,12 +233,28 @@ default = {'force_to_top': [],
            'length_sort': False,
            'add_imports': [],
            'remove_imports': [],
-           'default_section': 'FIRSTPARTY'}
+           'default_section': 'FIRSTPARTY',
+           'timeout': 0}
+
+
+# Deadlines are measured with a clock that never jumps, where the interpreter has one.
+_clock = getattr(time, 'monotonic', time.time)
+
+
+class _DeadlineExceeded(Exception):
+    """Raised when sorting a file takes longer than the configured 'timeout'."""
+
+
+def _check_deadline(deadline):
+    """Raises _DeadlineExceeded if the given deadline (if any) has passed."""
+    if deadline and _clock() > deadline:
+        raise _DeadlineExceeded()
 
 
 class SortImports(object):
     config = default
     incorrectly_sorted = False
+    timed_out = False
 
     def __init__(self, file_path=None, file_contents=None,
                  write_to_stdout=False, check=False, show_diff=False,
@@ -117,19 +262,25 @@ class SortImports(object):
         if setting_overrides:
             self.config = default.copy()
             self.config.update(setting_overrides)
+        self.deadline = self.config['timeout'] and _clock() + self.config['timeout'] or None
 
         file_name = file_path
         self.file_path = file_path or ''
         if file_path:
-            file_path = os.path.abspath(file_path)
+            if file_contents is None:
+                file_path = os.path.abspath(file_path)
             if '/' in file_name:
                 file_name = file_name[file_name.rfind('/') + 1:]
-            if file_name in self.config['skip']:
+            if _path_matcher(self.config['skip'])(self.file_path):
                 print(
                     "WARNING: {0} was skipped as it's listed in 'skip' "
                     "setting".format(file_path),
                     file=stderr)
                 file_contents = None
+            elif file_contents is not None:
+                # The contents were read elsewhere (such as from an archive), file_path only names them in reports
+                # and they are never written back.
+                file_name = None
             else:
                 self.file_path = file_path
                 with io.open(file_path,
@@ -153,9 +304,19 @@ class SortImports(object):
 
         self.index = 0
         self.import_index = -1
-        self._parse()
-        if self.import_index != -1:
-            self._add_formatted_imports()
+        try:
+            self._parse()
+            if self.import_index != -1:
+                self._add_formatted_imports()
+            _check_deadline(self.deadline)
+        except _DeadlineExceeded:
+            print(
+                'WARNING: {0} was left untouched as sorting it took longer than the {1} second '
+                'timeout'.format(self.file_path, self.config['timeout']),
+                file=stderr)
+            self.output = file_contents
+            self.timed_out = True
+            return
 
         while self.out_lines and self.out_lines[-1].strip() == '':
             self.out_lines.pop(-1)
@@ -216,6 +377,8 @@ class SortImports(object):
         elif ((name in self.config['known_first_party']) or
               (first_part in self.config['known_first_party'])):
             return SECTIONS.FIRSTPARTY
+        elif name.split('.')[0] in standard_library(self.config['python_version']):
+            return SECTIONS.STDLIB
 
         for prefix in PYTHONPATH:
             module_path = '/'.join((prefix, name.replace('.', '/')))
@@ -226,8 +389,6 @@ class SortImports(object):
                  os.path.isdir(package_path))):
                 if 'site-packages' in prefix or 'dist-packages' in prefix:
                     return SECTIONS.THIRDPARTY
-                elif 'python2' in prefix.lower() or 'python3' in prefix.lower():
-                    return SECTIONS.STDLIB
                 else:
                     return SECTIONS.FIRSTPARTY
 
@@ -236,6 +397,7 @@ class SortImports(object):
     def _get_line(self):
         """Returns the current line from the file while incrementing the
         index."""
+        _check_deadline(self.deadline)
         line = self.in_lines[self.index]
         self.index += 1
         return line
@@ -252,6 +414,7 @@ class SortImports(object):
 
         """
         output = []
+        remove_imports = set(self.config['remove_imports'])
         for section in itertools.chain(SECTIONS, self.config['forced_separate']):
             straight_modules = list(self.imports[section]['straight'])
             straight_modules = sorted(
@@ -261,7 +424,8 @@ class SortImports(object):
                     self.config))
 
             for module in straight_modules:
-                if module in self.config['remove_imports']:
+                _check_deadline(self.deadline)
+                if module in remove_imports:
                     continue
 
                 if module in self.as_map:
@@ -277,7 +441,8 @@ class SortImports(object):
                     key,
                     self.config))
             for module in from_modules:
-                if module in self.config['remove_imports']:
+                _check_deadline(self.deadline)
+                if module in remove_imports:
                     continue
 
                 import_start = 'from {0} import '.format(module)
@@ -287,11 +452,12 @@ class SortImports(object):
                     key=lambda key: _module_key(
                         key,
                         self.config))
-                if self.config['remove_imports']:
+                if remove_imports:
                     from_imports = [line for line in from_imports if not '{0}.{1}'.format(module, line) in
-                                    self.config['remove_imports']]
+                                    remove_imports]
 
-                for from_import in copy.copy(from_imports):
+                not_aliased = []
+                for from_import in from_imports:
                     import_as = self.as_map.get(
                         module +
                         '.' +
@@ -303,16 +469,15 @@ class SortImports(object):
                             '{0} as {1}'.format(
                                 from_import,
                                 import_as))
-                        from_imports.remove(from_import)
+                    else:
+                        not_aliased.append(from_import)
+                from_imports = not_aliased
 
                 if from_imports:
                     if '*' in from_imports:
                         import_statement = '{0}*'.format(import_start)
                     else:
-                        import_statement = import_start + from_imports.pop(0)
-                        for from_import in from_imports:
-                            import_statement += '\n{0}{1}'.format(import_start,
-                                                                  from_import)
+                        import_statement = '\n'.join(import_start + from_import for from_import in from_imports)
 
                     output.append(import_statement)
 
@@ -336,30 +501,37 @@ class SortImports(object):
             else:
                 self.out_lines[imports_tail:0] = ['']
 
+    def _strip_aliases(self, imports, import_type):
+        """Records every 'name as alias' pair found in imports within as_map,
+        returning the imports with the aliases removed.
+
+        Done in a single pass so huge import statements stay linear.
+
+        """
+        stripped = []
+        tokens = iter(imports)
+        for token in tokens:
+            if token != 'as' or not stripped:
+                stripped.append(token)
+                continue
+
+            import_as = next(tokens, None)
+            if import_as is None:
+                stripped.append(token)
+                break
+            if import_type == 'from':
+                self.as_map[stripped[0] + '.' + stripped[-1]] = import_as
+            else:
+                self.as_map[stripped[-1]] = import_as
+        return stripped
+
     def _parse(self):
         """Parses a python file taking out and categorizing imports."""
         in_quote = False
         while not self._at_end():
             line = self._get_line()
             skip_line = in_quote
-            if '"' in line or "'" in line:
-                index = 0
-                while index < len(line):
-                    if line[index] == '\\':
-                        index += 1
-                    elif in_quote:
-                        if line[index:index + len(in_quote)] == in_quote:
-                            in_quote = False
-                    elif line[index] in ("'", '"'):
-                        long_quote = line[index:index + 3]
-                        if long_quote in ('"""', "'''"):
-                            in_quote = long_quote
-                            index += 2
-                        else:
-                            in_quote = line[index]
-                    elif line[index] == '#':
-                        break
-                    index += 1
+            in_quote = _quote_state(line, in_quote, self.deadline)
 
             import_type = _import_type(line)
             if not import_type or skip_line:
@@ -369,15 +541,16 @@ class SortImports(object):
             if self.import_index == -1:
                 self.import_index = self.index - 1
 
-            import_string = _strip_comments(line)
+            import_lines = [_strip_comments(line)]
             if '(' in line and not self._at_end():
                 while not line.strip().endswith(')') and not self._at_end():
                     line = _strip_comments(self._get_line())
-                    import_string += '\n' + line
+                    import_lines.append(line)
             else:
                 while line.strip().endswith('\\'):
                     line = _strip_comments(self._get_line())
-                    import_string += '\n' + line
+                    import_lines.append(line)
+            import_string = '\n'.join(import_lines)
 
             import_string = import_string.replace('_import', '[[i]]')
             for remove_syntax in ['\\', '(', ')', ',', 'from ', 'import ']:
@@ -385,15 +558,8 @@ class SortImports(object):
             import_string = import_string.replace('[[i]]', '_import')
 
             imports = import_string.split()
-            if 'as' in imports and (imports.index('as') + 1) < len(imports):
-                while 'as' in imports:
-                    index = imports.index('as')
-                    if import_type == 'from':
-                        self.as_map[imports[0] + '.' +
-                                    imports[index - 1]] = imports[index + 1]
-                    else:
-                        self.as_map[imports[index - 1]] = imports[index + 1]
-                    del imports[index:index + 2]
+            if 'as' in imports:
+                imports = self._strip_aliases(imports, import_type)
             if import_type == 'from':
                 import_from = imports.pop(0)
                 root = self.imports[
@@ -410,6 +576,98 @@ class SortImports(object):
                         self.place_module(module)][import_type].add(module)
 
 
+def standard_library(python_version=None, _derived={}, _warned=set()):
+    """Returns the frozenset of top level standard library module names for the given Python version.
+
+    python_version is a 'MAJOR.MINOR' string defaulting to the running interpreter. Versions within
+    STANDARD_LIBRARIES use their precomputed table. Otherwise the running interpreter's table is derived, once, from
+    its builtin modules and standard library directories, while any other version warns and uses the table of the
+    closest known version.
+    """
+    running_version = '{0}.{1}'.format(*sys.version_info[:2])
+    python_version = python_version or running_version
+    if python_version in STANDARD_LIBRARIES:
+        return STANDARD_LIBRARIES[python_version]
+    if python_version == running_version:
+        if running_version not in _derived:
+            _derived[running_version] = _interpreter_standard_library()
+        return _derived[running_version]
+
+    closest_version = _closest_version(python_version)
+    if python_version not in _warned:
+        _warned.add(python_version)
+        print('WARNING: No standard library table is known for Python {0}, using the one for Python {1}'.format(
+            python_version, closest_version), file=stderr)
+    return STANDARD_LIBRARIES[closest_version]
+
+
+def _closest_version(python_version):
+    """Returns the version within STANDARD_LIBRARIES closest to the given 'MAJOR.MINOR' version."""
+    try:
+        major, minor = (int(part) for part in python_version.split('.')[:2])
+    except ValueError:
+        raise ValueError('{0} is not a MAJOR.MINOR Python version'.format(python_version))
+
+    known_versions = sorted(tuple(int(part) for part in version.split('.')) for version in STANDARD_LIBRARIES)
+    same_major = [version for version in known_versions if version[0] == major]
+    if same_major:
+        closest = min(same_major, key=lambda version: abs(version[1] - minor))
+    else:
+        closest = known_versions[-1]
+    return '{0}.{1}'.format(*closest)
+
+
+def _interpreter_standard_library():
+    """Builds the set of top level standard library module names available to the running interpreter."""
+    names = set(sys.builtin_module_names)
+    names.update(getattr(sys, 'stdlib_module_names', ()))
+
+    standard_library_path = os.path.dirname(os.__file__)
+    for directory in (standard_library_path, os.path.join(standard_library_path, 'lib-dynload')):
+        if not os.path.isdir(directory):
+            continue
+        for entry in os.listdir(directory):
+            name, _, extension = entry.partition('.')
+            if not re.match(r'[A-Za-z_]\w*$', name) or name in ('site-packages', 'dist-packages'):
+                continue
+            if extension.endswith(('py', 'pyc', 'so', 'pyd')) or (not extension and
+                                                                 os.path.isdir(os.path.join(directory, entry))):
+                names.add(name)
+    names.discard('__pycache__')
+    return frozenset(names)
+
+
+def _quote_state(line, in_quote, deadline=None):
+    """Returns the quote left open at the end of line (or False if none) given the one open at its start.
+
+    Very long lines check the deadline (if any) as they are scanned.
+    """
+    if '"' in line or "'" in line:
+        index = 0
+        next_deadline_check = 4096
+        while index < len(line):
+            if deadline and index >= next_deadline_check:
+                _check_deadline(deadline)
+                next_deadline_check = index + 4096
+
+            if line[index] == '\\':
+                index += 1
+            elif in_quote:
+                if line[index:index + len(in_quote)] == in_quote:
+                    in_quote = False
+            elif line[index] in ("'", '"'):
+                long_quote = line[index:index + 3]
+                if long_quote in ('"""', "'''"):
+                    in_quote = long_quote
+                    index += 2
+                else:
+                    in_quote = line[index]
+            elif line[index] == '#':
+                break
+            index += 1
+    return in_quote
+
+
 def _import_type(line):
     """If the current line is an import line it will return its type (from
     or straight)"""
@@ -434,27 +692,311 @@ def _strip_comments(line):
         print(
             'Removing comment(%s) so imports can be sorted correctly' %
             line[comment_start:], file=stderr)
-        line = line[:comment_start]
+    return _strip_comment_text(line)
+
 
+def _strip_comment_text(line):
+    """Removes any comment from line without reporting it."""
+    comment_start = line.find('#')
+    if comment_start != -1:
+        line = line[:comment_start]
     return line
 
 
+SortedRange = namedtuple('SortedRange', ('start', 'end', 'output'))
+
+
+def sort_range(file_contents, start, end=None, **setting_overrides):
+    """Sorts only the imports found within a range of lines of file_contents.
+
+    Lines are numbered from 1 and the range is inclusive. If end is not given the import block containing line
+    start is sorted instead. The range is widened so that it never splits a multi-line import statement.
+
+    Returns a SortedRange holding the first and last line replaced along with the text to replace them with, or
+    None if there are no imports within the range. Only the lines up to the end of the range are scanned.
+    """
+    if ('isort:' + 'skip_file') in file_contents:
+        return None
+
+    lines = file_contents.split('\n')
+    if not 1 <= start <= len(lines) or (end is not None and not start <= end <= len(lines)):
+        raise ValueError('Line range {0}:{1} is outside of the {2} lines given'.format(start, end, len(lines)))
+
+    quoted = _QuotedLines(lines)
+    if end is None:
+        block = _import_block(lines, start - 1, quoted)
+        if not block:
+            return None
+        first_line, last_line = block
+    else:
+        first_line = _statement_start(lines, start - 1, quoted)
+        last_line = _statement_end(lines, _statement_start(lines, end - 1, quoted), quoted) - 1
+        last_line = max(last_line, end - 1)
+        while quoted[first_line]:
+            first_line -= 1
+        while last_line + 1 < len(lines) and quoted[last_line + 1]:
+            last_line += 1
+        if not any(_is_import(lines, index, quoted) for index in range(first_line, last_line + 1)):
+            return None
+
+    original = '\n'.join(lines[first_line:last_line + 1]) + '\n'
+    output = SortImports(file_contents=original, **setting_overrides).output
+    return SortedRange(first_line + 1, last_line + 1, output)
+
+
+def sort_file_async(file_path, executor=None, **setting_overrides):
+    """Sorts the imports of file_path without blocking the running asyncio event loop, so it must be called from a
+    coroutine running within that loop.
+
+    All file I/O and sorting happens within executor (the loop's default executor if not given). Returns an
+    awaitable future of the resulting SortImports instance.
+    """
+    if asyncio is None:
+        raise RuntimeError('sort_file_async requires asyncio (Python 3.4 or later)')
+    loop = getattr(asyncio, 'get_running_loop', asyncio.get_event_loop)()
+    return loop.run_in_executor(executor, partial(SortImports, file_path, **setting_overrides))
+
+
+def sort_files_async(file_paths, concurrency=8, **setting_overrides):
+    """Sorts the imports of every file in file_paths without blocking the running asyncio event loop, with at most
+    concurrency files being read, sorted or written at once.
+
+    Returns an awaitable future of the resulting SortImports instances in the order file_paths were given.
+    Cancelling it cancels every file that has not started being sorted yet.
+    """
+    if asyncio is None:
+        raise RuntimeError('sort_files_async requires asyncio (Python 3.4 or later)')
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    sorted_files = asyncio.gather(*[sort_file_async(file_path, executor, **setting_overrides)
+                                    for file_path in file_paths])
+    sorted_files.add_done_callback(lambda future: executor.shutdown(wait=False))
+    return sorted_files
+
+
+class _QuotedLines(object):
+    """Tells, for each line, whether it starts within a string (such as a docstring) as SortImports._parse sees it.
+
+    Lines are only scanned as far as the furthest line asked about. Lines within strings are never treated as
+    imports.
+    """
+
+    def __init__(self, lines):
+        self.lines = lines
+        self.quoted = []
+        self.in_quote = False
+
+    def __getitem__(self, index):
+        while len(self.quoted) <= index:
+            self.quoted.append(bool(self.in_quote))
+            self.in_quote = _quote_state(self.lines[len(self.quoted) - 1], self.in_quote)
+        return self.quoted[index]
+
+
+def _is_import(lines, index, quoted):
+    """Returns True if lines[index] starts an import statement outside of any string."""
+    return not quoted[index] and bool(_import_type(lines[index]))
+
+
+def _statement_start(lines, index, quoted):
+    """Returns the index of the line on which the statement containing lines[index] begins.
+
+    Only lines following a backslash or within a parenthesised import are treated as continuations, so lines
+    within other indented code are never widened back to their enclosing def or class.
+    """
+    while index > 0 and _strip_comment_text(lines[index - 1]).rstrip().endswith('\\'):
+        index -= 1
+
+    candidate = index
+    while candidate > 0 and (lines[candidate][:1].isspace() or lines[candidate].startswith(')') or
+                             not lines[candidate].strip()):
+        candidate -= 1
+    if (candidate != index and _is_import(lines, candidate, quoted) and '(' in lines[candidate] and
+            _statement_end(lines, candidate, quoted) > index):
+        return candidate
+    return index
+
+
+def _statement_end(lines, index, quoted):
+    """Returns the index just past the last line of the statement starting at lines[index], following the same
+    continuation rules as SortImports._parse."""
+    line = _strip_comment_text(lines[index])
+    index += 1
+    if _is_import(lines, index - 1, quoted) and '(' in line:
+        while not line.strip().endswith(')') and index < len(lines):
+            line = _strip_comment_text(lines[index])
+            index += 1
+    else:
+        while line.strip().endswith('\\') and index < len(lines):
+            line = _strip_comment_text(lines[index])
+            index += 1
+    return index
+
+
+def _import_block(lines, index, quoted):
+    """Returns the (first, last) line indexes of the run of import statements and blank lines surrounding
+    lines[index], or None if that line is not part of one."""
+    statement = _statement_start(lines, index, quoted)
+    if not _is_import(lines, statement, quoted):
+        return None
+
+    first = statement
+    while first > 0:
+        previous = _statement_start(lines, first - 1, quoted)
+        if _is_import(lines, previous, quoted) or not (lines[previous].strip() or quoted[previous]):
+            first = previous
+        else:
+            break
+
+    last = statement
+    index = statement
+    while index < len(lines):
+        if _is_import(lines, index, quoted):
+            index = _statement_end(lines, index, quoted)
+            last = index - 1
+        elif not (lines[index].strip() or quoted[index]):
+            index += 1
+        else:
+            break
+
+    while not lines[first].strip():
+        first += 1
+    return first, last
+
+
+def _path_matcher(patterns, _compiled={}):
+    """Returns a function telling if a path matches any of the given skip or include patterns.
+
+    Patterns without a '/' are globs matched against the path's base name. Patterns containing a '/' are globs
+    matched against the path relative to the current directory (or its absolute path, if it has no relative form)
+    and every directory leading up to it, so 'build/' or 'src/vendor*' exclude everything beneath the matched
+    directory. Each set of patterns is only compiled once.
+    """
+    patterns = tuple(patterns)
+    if patterns not in _compiled:
+        name_patterns = [re.compile(fnmatch.translate(pattern)).match for pattern in patterns if '/' not in pattern]
+        path_patterns = [re.compile(fnmatch.translate(pattern.rstrip('/'))).match for pattern in patterns
+                         if '/' in pattern]
+
+        def matches(path):
+            path = os.path.normpath(path)
+            base_name = os.path.basename(path)
+            if any(match(base_name) for match in name_patterns):
+                return True
+            if not path_patterns:
+                return False
+            try:
+                path = os.path.relpath(path)
+            except ValueError:  # on Windows, a path on another drive has no relative form
+                path = os.path.abspath(path)
+            parts = path.replace(os.sep, '/').split('/')
+            return any(match('/'.join(parts[:depth])) for depth in range(1, len(parts) + 1)
+                       for match in path_patterns)
+
+        _compiled[patterns] = matches
+    return _compiled[patterns]
+
+
+def _iter_source_files(paths, config):
+    """Yields each file to sort, walking any directories given while pruning those matching 'skip' before any of
+    their contents are listed."""
+    is_skipped = _path_matcher(config['skip'])
+    is_included = _path_matcher(config['include'])
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+
+        for directory, directory_names, file_names in os.walk(path):
+            directory_names[:] = sorted(name for name in directory_names
+                                        if not is_skipped(os.path.join(directory, name)))
+            for file_name in sorted(file_names):
+                file_path = os.path.join(directory, file_name)
+                if is_included(file_path) and not is_skipped(file_path):
+                    yield file_path
+
+
+def _is_archive(file_path):
+    """Returns True if file_path names a wheel, zip, or tar archive isort can read Python sources from."""
+    return file_path.lower().endswith(ARCHIVE_EXTENSIONS) and os.path.isfile(file_path)
+
+
+def _archive_sources(archive_path):
+    """Yields the (member name, undecoded contents) of every Python source within an archive without extracting
+    it."""
+    if zipfile.is_zipfile(archive_path):
+        archive = zipfile.ZipFile(archive_path)
+        try:
+            for member_name in archive.namelist():
+                if member_name.endswith('.py'):
+                    yield member_name, archive.read(member_name)
+        finally:
+            archive.close()
+    else:
+        archive = tarfile.open(archive_path)
+        try:
+            for member in archive:
+                if member.isfile() and member.name.endswith('.py'):
+                    yield member.name, archive.extractfile(member).read()
+        finally:
+            archive.close()
+
+
+def _git_sources(paths, ref=None, wanted=None):
+    """Yields the (path, undecoded contents) of every file under paths as of ref, or the staging area when ref is
+    None, for which wanted(path) is true.
+
+    Contents are read straight from the git object store through a single long-lived git cat-file --batch
+    process. Paths are relative to the current directory, which must be within the repository.
+    """
+    if ref:
+        listing = ['git', 'ls-tree', '-r', '-z', '--name-only', ref, '--']
+    else:
+        listing = ['git', 'ls-files', '-z', '--cached', '--']
+    file_names = subprocess.check_output(listing + list(paths)).decode('utf-8').split('\0')
+
+    cat_file = subprocess.Popen(['git', 'cat-file', '--batch'], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    try:
+        for file_name in file_names:
+            if not file_name or (wanted and not wanted(file_name)):
+                continue
+
+            cat_file.stdin.write('{0}:./{1}\n'.format(ref or '', file_name).encode('utf-8'))
+            cat_file.stdin.flush()
+            header = cat_file.stdout.readline().decode('utf-8').split()
+            if header[-1] == 'missing':
+                continue
+
+            contents = cat_file.stdout.read(int(header[2]))
+            cat_file.stdout.read(1)
+            if header[1] == 'blob':
+                yield file_name, contents
+    finally:
+        cat_file.stdin.close()
+        cat_file.wait()
+
+
 def main():
     parser = argparse.ArgumentParser(
         description='Sort Python import definitions alphabetically within logical sections.')
     parser.add_argument(
         'files',
         nargs='+',
-        help='One or more Python source files that need their imports sorted.')
+        help='One or more Python source files or directories that need their imports sorted. Wheels, zip and tar '
+        'archives are checked member by member without being extracted.')
     parser.add_argument(
         '-l', '--lines', help='The max length of an import line (used for wrapping long imports).',
         dest='line_length', type=int)
     parser.add_argument(
         '-s',
         '--skip',
-        help='Files that sort imports should skip over.',
+        help='Files or directories that sort imports should skip over, in addition to the default ones. Accepts '
+        'globs matched against base names, or against paths relative to the current directory when they contain a '
+        '"/".',
         dest='skip',
         action='append')
+    parser.add_argument(
+        '-f', '--filter', dest='include', action='append',
+        help='Glob of the files to sort when walking directories (defaults to *.py).')
     parser.add_argument(
         '-t', '--top', help='Force specific imports to the top of their appropriate section.',
         dest='force_to_top', action='append')
@@ -490,11 +1032,44 @@ def main():
         '-c', '--check-only', action='store_true', default=False, dest='check',
         help='Checks the file for unsorted imports and prints them to the command line without modifying '
         'the file.')
+    parser.add_argument(
+        '-py', '--python-version', dest='python_version',
+        help='The MAJOR.MINOR version of Python whose standard library imports are sorted into the STDLIB section '
+        '(defaults to the running interpreter).')
     parser.add_argument('-sd', '--section-default', dest='default_section',
                         help='Sets the default section for imports (by default FIRSTPARTY) options: ' + str(SECTION_NAMES))
     parser.add_argument(
         '-i', '--in-place', dest='show_diff', default=True, action='store_false',
         help='Write change in place.')
+    parser.add_argument(
+        '-lr', '--line-range', dest='line_range', type=str,
+        help='Only sort the imports within the given inclusive line range (START:END) or, if a single line number is '
+        'given, the import block containing that line. Prints the replaced range followed by its replacement text.')
+    parser.add_argument(
+        '-T', '--timeout', dest='timeout', type=float,
+        help='Leave any file that takes longer than the given number of seconds to sort untouched, reporting it as '
+        'timed out.')
+    parser.add_argument(
+        '--slowest', dest='slowest', type=int,
+        help='Report the given number of files that took the longest to sort.')
+    parser.add_argument(
+        '--shard', dest='shard', type=str,
+        help='Only process shard I of N (given as I/N) of the files, deterministically partitioned by path so that N '
+        'machines can share one run.')
+    parser.add_argument(
+        '--results', dest='results', type=str,
+        help='Write the result for every file processed to the given JSON file, for use with --merge-results.')
+    parser.add_argument(
+        '--merge-results', dest='merge_results', action='store_true',
+        help='Treat the files given as --results files written by each shard of a run, reporting their combined '
+        'result.')
+    parser.add_argument(
+        '--git-ref', dest='git_ref', type=str,
+        help='Check the files as of the given git commit, branch or tag, reading them straight from the repository '
+        'instead of the working tree.')
+    parser.add_argument(
+        '--staged', dest='staged', action='store_true',
+        help='Check the files as they are in the git staging area instead of the working tree.')
     parser.add_argument(
         '-v',
         '--version',
@@ -504,6 +1079,45 @@ def main():
     arguments = dict((key, value)
                      for (key, value) in vars(parser.parse_args()).items() if value)
     file_names = arguments.pop('files', [])
+    if 'skip' in arguments:
+        arguments['skip'] = default['skip'] + arguments['skip']
+
+    if 'line_range' in arguments:
+        return _main_line_range(file_names, arguments)
+    if arguments.pop('merge_results', False):
+        return _merge_results(file_names)
+    git_ref = arguments.pop('git_ref', None)
+    staged = arguments.pop('staged', False)
+    if 'python_version' in arguments:
+        try:
+            standard_library(arguments['python_version'])
+        except ValueError as error:
+            print('ERROR: {0}'.format(error), file=stderr)
+            return 1
+    if staged or git_ref:
+        for option in ('shard', 'results', 'slowest'):
+            if option in arguments:
+                print('ERROR: --{0} can not be used with --git-ref or --staged'.format(option), file=stderr)
+                return 1
+        try:
+            if _sort_git(file_names, git_ref, arguments):
+                return 1
+        except (subprocess.CalledProcessError, OSError) as error:
+            print('ERROR: Could not read the files from git: {0}'.format(error), file=stderr)
+            return 1
+        return
+    shard = arguments.pop('shard', None)
+    results_path = arguments.pop('results', None)
+    slowest = arguments.pop('slowest', None)
+    if shard:
+        try:
+            shard = _parse_shard(shard)
+        except ValueError as error:
+            print('ERROR: {0}'.format(error), file=stderr)
+            return 1
+    if results_path and not arguments.get('check', False):
+        print('ERROR: --results can only be used with --check-only', file=stderr)
+        return 1
 
     if file_names == ['-']:
         SortImports(
@@ -512,15 +1126,208 @@ def main():
             **arguments)
     else:
         wrong_sorted_files = False
-        for file_name in file_names:
-            incorrectly_sorted = SortImports(
-                file_name,
-                **arguments).incorrectly_sorted
-            if arguments.get('check', False) and incorrectly_sorted:
+        results = {}
+        durations = []
+        config = dict(default, **arguments)
+        for file_name in _iter_source_files(file_names, config):
+            if shard and _shard_of(file_name, shard[1]) != shard[0]:
+                continue
+
+            started = _clock()
+            timed_out = False
+            if _is_archive(file_name):
+                incorrectly_sorted = _sort_archive(file_name, arguments, results)
+            else:
+                sorted_file = SortImports(
+                    file_name,
+                    **arguments)
+                incorrectly_sorted = sorted_file.incorrectly_sorted
+                timed_out = sorted_file.timed_out
+                results[_result_path(file_name)] = _result_status(sorted_file)
+            durations.append((_clock() - started, file_name))
+            # Only checks (including those forced on archives) ever report files as incorrectly sorted.
+            if incorrectly_sorted or (arguments.get('check', False) and timed_out):
                 wrong_sorted_files = True
+
+        if slowest:
+            print('Slowest files:')
+            for duration, file_name in sorted(durations, reverse=True)[:slowest]:
+                print('  {0:.3f}s {1}'.format(duration, file_name))
+
+        if results_path:
+            with codecs.open(results_path, encoding='utf-8', mode='w') as results_file:
+                results_file.write(json.dumps({'shard': shard and list(shard) or [1, 1],
+                                               'files': results}, indent=2, sort_keys=True))
         if wrong_sorted_files:
             return 1
 
 
+def _parse_shard(shard):
+    """Returns the (index, count) of a shard given as I/N, where I counts from 1."""
+    index, _, count = shard.partition('/')
+    try:
+        index, count = int(index), int(count)
+    except ValueError:
+        index = count = 0
+    if not 1 <= index <= count:
+        raise ValueError('{0} is not a valid shard, expected I/N with 1 <= I <= N'.format(shard))
+    return index, count
+
+
+def _result_path(file_name):
+    """Returns the path a file is reported under within --results files, the same on every machine."""
+    return os.path.relpath(file_name).replace(os.sep, '/')
+
+
+def _result_status(sorted_file):
+    """Returns the status a checked file is recorded with within --results files."""
+    if sorted_file.timed_out:
+        return 'timed_out'
+    return 'unsorted' if sorted_file.incorrectly_sorted else 'ok'
+
+
+def _shard_of(file_name, count):
+    """Returns the shard (counting from 1) a file belongs to, using a hash of its path that is stable across
+    machines and interpreters."""
+    return (zlib.crc32(_result_path(file_name).encode('utf-8')) & 0xffffffff) % count + 1
+
+
+def _merge_results(results_paths):
+    """Combines the --results files written by every shard of a run into one report and exit status."""
+    results = {}
+    shards = set()
+    counts = set()
+    for results_path in results_paths:
+        try:
+            with io.open(results_path, encoding='utf-8') as results_file:
+                shard_results = json.load(results_file)
+            index, count = shard_results['shard']
+            files = dict(shard_results['files'])
+        except (IOError, OSError, ValueError, KeyError, TypeError):
+            print('ERROR: {0} is not a valid results file'.format(results_path), file=stderr)
+            return 1
+        shards.add(index)
+        counts.add(count)
+        results.update(files)
+
+    errors = {'unsorted': 'Imports are incorrectly sorted.',
+              'timed_out': 'Timed out before its imports could be checked.',
+              'error': 'Could not be read.'}
+    wrong_sorted_files = False
+    for file_name in sorted(results):
+        if results[file_name] != 'ok':
+            print('ERROR: {0} {1}'.format(file_name, errors.get(results[file_name], results[file_name])),
+                  file=stderr)
+            wrong_sorted_files = True
+    print('{0} files checked across {1} shards, {2} incorrectly sorted, {3} timed out, {4} unreadable'.format(
+        len(results), len(shards), sum(1 for status in results.values() if status == 'unsorted'),
+        sum(1 for status in results.values() if status == 'timed_out'),
+        sum(1 for status in results.values() if status == 'error')))
+
+    if len(counts) != 1 or shards != set(range(1, counts.pop() + 1)):
+        print('ERROR: Results are missing for some shards or come from different shard counts', file=stderr)
+        return 1
+    if wrong_sorted_files:
+        return 1
+
+
+def _read_only_arguments(arguments, source):
+    """Returns arguments adjusted for sources that can not be changed in place: unless a diff or stdout output was
+    requested they are only checked."""
+    if not (arguments.get('check') or arguments.get('show_diff') or arguments.get('write_to_stdout')):
+        print('WARNING: {0} can not be sorted in place so it will only be checked'.format(source), file=stderr)
+        return dict(arguments, check=True)
+    return arguments
+
+
+def _sort_archive(archive_path, arguments, results=None):
+    """Sorts every Python source within the given archive straight from memory, reporting each by member path and,
+    if given, recording its status within results.
+
+    Returns True if any member had incorrectly sorted imports, could not be decoded or, when checking, timed out, or
+    if the archive itself could not be read.
+    """
+    if results is None:
+        results = {}
+    arguments = _read_only_arguments(arguments, archive_path)
+    incorrectly_sorted = False
+    try:
+        for member_name, file_contents in _archive_sources(archive_path):
+            member_path = os.path.join(archive_path, member_name)
+            try:
+                file_contents = file_contents.decode('utf-8')
+            except UnicodeDecodeError:
+                print('ERROR: {0} could not be decoded as UTF-8.'.format(member_path), file=stderr)
+                results[_result_path(member_path)] = 'error'
+                incorrectly_sorted = True
+                continue
+            sorted_file = SortImports(member_path, file_contents=file_contents, **arguments)
+            results[_result_path(member_path)] = _result_status(sorted_file)
+            if sorted_file.incorrectly_sorted or (arguments.get('check') and sorted_file.timed_out):
+                incorrectly_sorted = True
+    except (zipfile.BadZipfile, tarfile.TarError, EOFError, IOError, zlib.error):
+        print('ERROR: {0} could not be read.'.format(archive_path), file=stderr)
+        results[_result_path(archive_path)] = 'error'
+        incorrectly_sorted = True
+    return incorrectly_sorted
+
+
+def _sort_git(paths, ref, arguments):
+    """Sorts every Python source under paths as of the given git ref (or the staging area when ref is None),
+    reporting each by path. Nothing in the working tree is read or written.
+
+    Returns True if any file had incorrectly sorted imports, timed out while being checked or could not be decoded.
+    """
+    arguments = _read_only_arguments(arguments, ref and 'git ref {0}'.format(ref) or 'the git staging area')
+    config = dict(default, **arguments)
+    is_skipped = _path_matcher(config['skip'])
+    is_included = _path_matcher(config['include'])
+
+    incorrectly_sorted = False
+    for file_name, file_contents in _git_sources(paths, ref, lambda file_name: is_included(file_name) and
+                                                 not is_skipped(file_name)):
+        try:
+            file_contents = file_contents.decode('utf-8')
+        except UnicodeDecodeError:
+            print('ERROR: {0} could not be decoded as UTF-8.'.format(file_name), file=stderr)
+            incorrectly_sorted = True
+            continue
+        sorted_file = SortImports(file_name, file_contents=file_contents, **arguments)
+        if sorted_file.incorrectly_sorted or (arguments.get('check') and sorted_file.timed_out):
+            incorrectly_sorted = True
+    return incorrectly_sorted
+
+
+def _main_line_range(file_names, arguments):
+    """Sorts the requested line range of a single file (or stdin) writing the result to stdout."""
+    if len(file_names) != 1:
+        print('ERROR: --line-range can only be used with a single file', file=stderr)
+        return 1
+
+    for option in ('check', 'show_diff', 'write_to_stdout'):
+        arguments.pop(option, None)
+    line_range = arguments.pop('line_range')
+    start, _, end = line_range.partition(':')
+    try:
+        start, end = int(start), int(end) if end else None
+    except ValueError:
+        print('ERROR: {0} is not a valid line range'.format(line_range), file=stderr)
+        return 1
+
+    if file_names == ['-']:
+        file_contents = sys.stdin.read()
+    else:
+        with io.open(file_names[0], encoding='utf-8') as file_to_import_sort:
+            file_contents = file_to_import_sort.read()
+
+    try:
+        sorted_range = sort_range(file_contents, start, end, **arguments)
+    except ValueError as error:
+        print('ERROR: {0}'.format(error), file=stderr)
+        return 1
+    if sorted_range:
+        stdout.write('{0}:{1}\n{2}'.format(sorted_range.start, sorted_range.end, sorted_range.output))
+
+
 if __name__ == '__main__':
     sys.exit(main())
@@ -21,7 +21,17 @@ OTHER DEALINGS IN THE SOFTWARE.
 
 from __future__ import absolute_import, division, print_function, unicode_literals
 
-from isort import SortImports, WrapModes
+import json
+import os.path
+import subprocess
+import tarfile
+import timeit
+import zipfile
+
+import pytest
+
+import isort
+from isort import SortedRange, SortImports, WrapModes, sort_range
 
 REALLY_LONG_IMPORT = ('from third_party import lib1, lib2, lib3, lib4, lib5, lib6, lib7, lib8, lib9, lib10, lib11,'
                       'lib12, lib13, lib14, lib15, lib16, lib17, lib18, lib20, lib21, lib22')
@@ -291,3 +301,398 @@ def test_force_single_line_imports():
     assert test_output == ('from third_party import lib1\n'
                            'from third_party import lib2\n'
                            'from third_party import lib3\n')
+
+
+def test_huge_import_statement():
+    """Ensure parsing and formatting a single import statement scales linearly with the number of names."""
+    def huge_import(length):
+        names = ['name{0} as alias{0}'.format(index) if index % 2 else 'name{0}'.format(index)
+                 for index in range(length)]
+        return 'from package import ({0})\n'.format(',\n    '.join(names))
+
+    test_input = huge_import(10000)
+    test_output = SortImports(file_contents=test_input).output.split('\n')
+    assert len(test_output) == 10001
+    assert 'from package import name1 as alias1' in test_output
+    assert 'from package import name0' in test_output
+
+    def best_time(length):
+        contents = huge_import(length)
+        return min(timeit.repeat(lambda: SortImports(file_contents=contents), number=1, repeat=3))
+
+    # Quadrupling the statement size must not come anywhere close to the 16x a quadratic algorithm would need.
+    assert best_time(20000) < best_time(5000) * 10
+
+
+def test_sort_range():
+    """Test to ensure sorting only a range of lines or a single import block works as expected."""
+    test_input = ('"""Module docstring."""\n'
+                  'import sys\n'
+                  'from lib import (lib2,\n'
+                  '    lib1)\n'
+                  'import os\n'
+                  '\n'
+                  'x = 1\n'
+                  '\n'
+                  'def function():\n'
+                  '    pass\n'
+                  'import lib6\n'
+                  'import lib5\n')
+    assert sort_range(test_input, 4) == SortedRange(2, 5, ('import os\n'
+                                                          'import sys\n'
+                                                          '\n'
+                                                          'from lib import lib1\n'
+                                                          'from lib import lib2\n'))
+    assert sort_range(test_input, 12) == SortedRange(11, 12, ('import lib5\n'
+                                                             'import lib6\n'))
+    assert sort_range(test_input, 7) is None
+    assert sort_range(test_input, 3, 3) == SortedRange(3, 4, ('from lib import lib1\n'
+                                                             'from lib import lib2\n'))
+
+
+def test_archive_members(tmpdir, monkeypatch, capsys):
+    """Test to ensure Python sources within wheels and sdists are checked without extracting them."""
+    wheel_path = str(tmpdir.join('package-1.0-py2.py3-none-any.whl'))
+    wheel = zipfile.ZipFile(wheel_path, 'w')
+    wheel.writestr('package/__init__.py', 'import os\nimport sys\n')
+    wheel.writestr('package/unsorted.py', 'import sys\nimport os\n')
+    wheel.writestr('package-1.0.dist-info/METADATA', 'import sys\nimport os\n')
+    wheel.close()
+
+    sdist_source = tmpdir.join('sorted.py')
+    sdist_source.write('import os\nimport sys\n')
+    sdist_path = str(tmpdir.join('package-1.0.tar.gz'))
+    sdist = tarfile.open(sdist_path, 'w:gz')
+    sdist.add(str(sdist_source), arcname='package-1.0/package/sorted.py')
+    sdist.close()
+
+    monkeypatch.setattr('sys.argv', ['isort', '--check-only', wheel_path, sdist_path])
+    assert isort.main() == 1
+    out = capsys.readouterr()[0]
+    assert 'SUCCESS: {0} Everything'.format(wheel_path + '/package/__init__.py') in out
+    assert 'SUCCESS: {0} Everything'.format(sdist_path + '/package-1.0/package/sorted.py') in out
+    assert 'unsorted.py' not in out
+    assert 'METADATA' not in out
+
+    monkeypatch.setattr('sys.argv', ['isort', '--check-only', sdist_path])
+    assert not isort.main()
+
+    monkeypatch.setattr('sys.argv', ['isort', '-i', wheel_path])
+    assert isort.main() == 1
+
+    latin1_path = str(tmpdir.join('latin1.zip'))
+    latin1 = zipfile.ZipFile(latin1_path, 'w')
+    latin1.writestr('package/latin1.py', '# caf\xe9\nimport os\n'.encode('latin-1'))
+    latin1.writestr('package/sorted.py', 'import os\nimport sys\n')
+    latin1.close()
+    monkeypatch.setattr('sys.argv', ['isort', '--check-only', latin1_path])
+    assert isort.main() == 1
+    assert 'SUCCESS: {0} Everything'.format(latin1_path + '/package/sorted.py') in capsys.readouterr()[0]
+
+    tmpdir.join('corrupt.whl').write('import os\n')
+    monkeypatch.chdir(tmpdir)
+    monkeypatch.setattr('sys.argv', ['isort', '--check-only', '--results', 'results.json', 'corrupt.whl',
+                                     'package-1.0.tar.gz'])
+    assert isort.main() == 1
+    with open('results.json') as results_file:
+        results = json.load(results_file)['files']
+    assert results['corrupt.whl'] == 'error'
+    assert results['package-1.0.tar.gz/package-1.0/package/sorted.py'] == 'ok'
+
+
+def test_directory_skip_patterns(tmpdir, monkeypatch, capsys):
+    """Test to ensure skip patterns prune whole directories when walking and support globs and paths."""
+    for path in ('project/.tox/py27/lib/site.py', 'project/build/lib/module.py', 'project/vendor/six.py',
+                 'project/package/generated_pb2.py', 'project/notes.txt'):
+        tmpdir.join(path).ensure().write('import sys\nimport os\n')
+    for path in ('project/module.py', 'project/package/build/module.py'):
+        tmpdir.join(path).ensure().write('import os\nimport sys\n')
+
+    monkeypatch.chdir(str(tmpdir))
+    monkeypatch.setattr('sys.argv', ['isort', '--check-only', '-s', 'project/build/', '-s', 'project/vendor/',
+                                     '-s', '*_pb2.py', 'project'])
+    assert not isort.main()
+    assert capsys.readouterr()[0] == ('SUCCESS: {0} Everything Looks Good!\n'
+                                      'SUCCESS: {1} Everything Looks Good!\n').format(
+        tmpdir.join('project/module.py'), tmpdir.join('project/package/build/module.py'))
+
+    monkeypatch.setattr('sys.argv', ['isort', '--check-only', '-s', 'project/build/', 'project/build/lib/module.py'])
+    assert not isort.main()
+
+    skip = isort._path_matcher(['.tox', 'build/', '*_pb2.py'])
+    assert skip('.tox')
+    assert skip('build/lib/module.py')
+    assert not skip('src/build/module.py')
+    assert skip('src/message_pb2.py')
+    assert not skip('src/module.py')
+
+    def other_drive(path, start=None):
+        raise ValueError('path is on mount {0!r}, start on mount {1!r}'.format(path, start))
+
+    monkeypatch.setattr('os.path.relpath', other_drive)
+    assert isort._path_matcher(['*_pb2.py'])(str(tmpdir.join('message_pb2.py')))
+    assert isort._path_matcher(['*/project/build/'])(str(tmpdir.join('project/build/lib/module.py')))
+    assert not isort._path_matcher(['*/project/build/'])(str(tmpdir.join('project/module.py')))
+
+
+def test_shards(tmpdir, monkeypatch):
+    """Test to ensure sharded runs partition the files deterministically and their results merge correctly."""
+    for index in range(20):
+        tmpdir.join('project/module{0}.py'.format(index)).ensure().write('import os\nimport sys\n')
+    tmpdir.join('project/module7.py').write('import sys\nimport os\n')
+    monkeypatch.chdir(str(tmpdir))
+
+    shard_files = []
+    for shard in ('1/3', '2/3', '3/3'):
+        results_path = str(tmpdir.join('results{0}.json'.format(shard[0])))
+        monkeypatch.setattr('sys.argv', ['isort', '--check-only', '--shard', shard, '--results', results_path,
+                                         'project'])
+        isort.main()
+        with open(results_path) as results_file:
+            shard_files.append(set(json.load(results_file)['files']))
+
+    assert sum(len(files) for files in shard_files) == 20
+    assert set.union(*shard_files) == set('project/module{0}.py'.format(index) for index in range(20))
+    assert all(shard_files)
+
+    results = [str(tmpdir.join('results{0}.json'.format(index))) for index in (1, 2, 3)]
+    monkeypatch.setattr('sys.argv', ['isort', '--merge-results'] + results)
+    assert isort.main() == 1
+
+    tmpdir.join('project/module7.py').write('import os\nimport sys\n')
+    for shard in ('1/3', '2/3', '3/3'):
+        monkeypatch.setattr('sys.argv', ['isort', '--check-only', '--shard', shard, '--results',
+                                         str(tmpdir.join('results{0}.json'.format(shard[0]))), 'project'])
+        isort.main()
+    monkeypatch.setattr('sys.argv', ['isort', '--merge-results'] + results)
+    assert not isort.main()
+    monkeypatch.setattr('sys.argv', ['isort', '--merge-results'] + results[:2])
+    assert isort.main() == 1
+    tmpdir.join('truncated.json').write(tmpdir.join('results1.json').read()[:10])
+    tmpdir.join('not_a_shard.json').write('[]')
+    for invalid in ('missing.json', 'truncated.json', 'not_a_shard.json'):
+        monkeypatch.setattr('sys.argv', ['isort', '--merge-results', str(tmpdir.join(invalid))] + results)
+        assert isort.main() == 1
+
+    monkeypatch.setattr('sys.argv', ['isort', '--shard', '1/3', '--results', results[0], 'project'])
+    assert isort.main() == 1
+
+    wheel = zipfile.ZipFile(str(tmpdir.join('project/package.whl')), 'w')
+    wheel.writestr('package/sorted.py', 'import os\nimport sys\n')
+    wheel.writestr('package/unsorted.py', 'import sys\nimport os\n')
+    wheel.close()
+    monkeypatch.setattr('sys.argv', ['isort', '--check-only', '--results', results[0], 'project/package.whl'])
+    assert isort.main() == 1
+    with open(results[0]) as results_file:
+        assert json.load(results_file)['files'] == {'project/package.whl/package/sorted.py': 'ok',
+                                                    'project/package.whl/package/unsorted.py': 'unsorted'}
+
+
+def test_sort_files_async(tmpdir):
+    """Test to ensure files can be sorted from an asyncio event loop with bounded concurrency."""
+    asyncio = pytest.importorskip('asyncio')
+
+    file_paths = []
+    for index in range(10):
+        file_path = tmpdir.join('module{0}.py'.format(index))
+        file_path.write('import sys\nimport os\n')
+        file_paths.append(str(file_path))
+
+    def run_in_loop(start):
+        """Calls start from within the running loop, as a coroutine would, returning the result of its future."""
+        started = loop.create_future()
+        loop.call_soon(lambda: start().add_done_callback(started.set_result))
+        return loop.run_until_complete(started).result()
+
+    loop = asyncio.new_event_loop()
+    try:
+        sorted_files = run_in_loop(lambda: isort.sort_files_async(file_paths, concurrency=3, check=True))
+        assert [sorted_file.file_path for sorted_file in sorted_files] == file_paths
+        assert all(sorted_file.incorrectly_sorted for sorted_file in sorted_files)
+
+        sorted_files = run_in_loop(lambda: isort.sort_files_async(file_paths, concurrency=3))
+        assert tmpdir.join('module9.py').read() == 'import os\nimport sys\n'
+
+        sorted_file = run_in_loop(lambda: isort.sort_file_async(file_paths[0], check=True))
+        assert not sorted_file.incorrectly_sorted
+
+        def cancelled():
+            sorted_files = isort.sort_files_async(file_paths, concurrency=1)
+            sorted_files.cancel()
+            return sorted_files
+        with pytest.raises(asyncio.CancelledError):
+            run_in_loop(cancelled)
+    finally:
+        loop.close()
+
+
+def test_timeout(tmpdir, monkeypatch, capsys):
+    """Test to ensure files taking longer than the configured timeout to sort are left untouched."""
+    test_input = 'import sys\nfrom os import (path,\n' + '    getcwd,\n' * 200000
+    sorted_file = SortImports(file_contents=test_input, timeout=0.000001)
+    assert sorted_file.timed_out
+    assert sorted_file.output == test_input
+
+    test_input = 'import sys\nimport os\nDATA = "' + 'a\\"' * 3000000 + '"\n'
+    sorted_file = SortImports(file_contents=test_input, timeout=0.05)
+    assert sorted_file.timed_out
+    assert sorted_file.output == test_input
+
+    sorted_file = SortImports(file_contents='import sys\nimport os\n', timeout=60)
+    assert not sorted_file.timed_out
+    assert sorted_file.output == 'import os\nimport sys\n'
+
+    pathological = tmpdir.join('pathological.py')
+    pathological.write(test_input)
+    tmpdir.join('fine.py').write('import sys\nimport os\n')
+    monkeypatch.setattr('sys.argv', ['isort', '-i', '--timeout', '0.000001', '--slowest', '1',
+                                     str(pathological), str(tmpdir.join('fine.py'))])
+    assert not isort.main()
+    assert pathological.read() == test_input
+    out = capsys.readouterr()[0]
+    assert out.startswith('Slowest files:\n')
+    assert out.rstrip().endswith(str(pathological))
+
+    wheel = zipfile.ZipFile(str(tmpdir.join('package.whl')), 'w')
+    sorted_input = test_input.replace('import sys\nimport os\n', 'import os\nimport sys\n\n')
+    wheel.writestr('package/pathological.py', sorted_input)
+    wheel.close()
+    monkeypatch.chdir(tmpdir)
+    monkeypatch.setattr('sys.argv', ['isort', '--check-only', '--timeout', '0.000001', '--results', 'results.json',
+                                     'package.whl'])
+    assert isort.main() == 1
+    with open('results.json') as results_file:
+        assert json.load(results_file)['files'] == {'package.whl/package/pathological.py': 'timed_out'}
+
+
+def test_standard_library_table(monkeypatch):
+    """Test to ensure standard library modules are recognized from the interpreter derived table, without any
+    filesystem probing, and for the requested Python version."""
+    def no_probing(path):
+        raise AssertionError('{0} was probed'.format(path))
+    monkeypatch.setattr(os.path, 'exists', no_probing)
+
+    test_input = ('import myproject\n'
+                  'import asyncio.tasks\n'
+                  'import json\n')
+    assert SortImports(file_contents=test_input, default_section='THIRDPARTY',
+                       known_first_party=['myproject']).output == ('import asyncio.tasks\n'
+                                                                   'import json\n'
+                                                                   '\n'
+                                                                   'import myproject\n')
+
+    assert 'asyncio' in isort.standard_library()
+    assert 'urllib2' in isort.standard_library('2.7')
+    assert 'asyncio' not in isort.standard_library('2.7')
+    assert isort.standard_library() is isort.standard_library()
+
+    assert 'tomllib' in isort.standard_library('3.11')
+    assert 'tomllib' not in isort.standard_library('3.6')
+    assert 'distutils' in isort.standard_library('3.8')
+    assert 'distutils' not in isort.standard_library('3.12')
+    assert 'winreg' in isort.standard_library('3.6')
+    assert '_hashlib' in isort.standard_library('3.6')
+
+    previously_known = set([
+        'abc', 'anydbm', 'argparse', 'array', 'asynchat', 'asyncore', 'atexit', 'base64', 'BaseHTTPServer', 'bisect',
+        'bz2', 'calendar', 'cgitb', 'cmd', 'codecs', 'collections', 'commands', 'compileall', 'ConfigParser',
+        'contextlib', 'Cookie', 'copy', 'cPickle', 'cProfile', 'cStringIO', 'csv', 'datetime', 'dbhash', 'dbm',
+        'decimal', 'difflib', 'dircache', 'dis', 'doctest', 'dumbdbm', 'EasyDialogs', 'errno', 'exceptions', 'filecmp',
+        'fileinput', 'fnmatch', 'fractions', 'functools', 'gc', 'gdbm', 'getopt', 'getpass', 'gettext', 'glob', 'grp',
+        'gzip', 'hashlib', 'heapq', 'hmac', 'imaplib', 'imp', 'inspect', 'itertools', 'json', 'linecache', 'locale',
+        'logging', 'mailbox', 'math', 'mhlib', 'mmap', 'multiprocessing', 'operator', 'optparse', 'os', 'pdb', 'pickle',
+        'pipes', 'pkgutil', 'platform', 'plistlib', 'pprint', 'profile', 'pstats', 'pwd', 'pyclbr', 'pydoc', 'Queue',
+        'random', 're', 'readline', 'resource', 'rlcompleter', 'robotparser', 'sched', 'select', 'shelve', 'shlex',
+        'shutil', 'signal', 'SimpleXMLRPCServer', 'site', 'sitecustomize', 'smtpd', 'smtplib', 'socket', 'SocketServer',
+        'sqlite3', 'string', 'StringIO', 'struct', 'subprocess', 'sys', 'sysconfig', 'tabnanny', 'tarfile', 'tempfile',
+        'textwrap', 'threading', 'time', 'timeit', 'trace', 'traceback', 'unittest', 'urllib', 'urllib2', 'urlparse',
+        'usercustomize', 'uuid', 'warnings', 'weakref', 'webbrowser', 'whichdb', 'xml', 'xmlrpclib', 'zipfile',
+        'zipimport', 'zlib'])
+    previously_known -= set(['sitecustomize', 'usercustomize', 'EasyDialogs'])
+    assert previously_known <= isort.PYTHON2_STANDARD_LIBRARY
+    assert set(['Tkinter', 'dbm', 'gdbm', '_hashlib']) <= isort.PYTHON2_STANDARD_LIBRARY
+    assert isort.standard_library('3.99') is isort.STANDARD_LIBRARIES['3.13']
+    assert isort.standard_library('2.6') is isort.PYTHON2_STANDARD_LIBRARY
+    with pytest.raises(ValueError):
+        isort.standard_library('three')
+
+
+def test_git_sources(tmpdir, monkeypatch, capsys):
+    """Test to ensure files can be checked as of a git commit or the staging area without touching the working
+    tree."""
+    def git(*arguments):
+        subprocess.check_call(('git', '-c', 'user.name=isort', '-c', 'user.email=isort@example.com') + arguments,
+                              stdout=subprocess.PIPE)
+
+    monkeypatch.chdir(str(tmpdir))
+    git('init', '-q')
+    tmpdir.join('package/module.py').ensure().write('import sys\nimport os\n')
+    tmpdir.join('package/other.py').write('import os\nimport sys\n')
+    tmpdir.join('package/data.txt').write('import sys\nimport os\n')
+    git('add', '.')
+    git('commit', '-q', '-m', 'unsorted')
+    tmpdir.join('package/module.py').write('import os\nimport sys\n')
+    git('add', 'package/module.py')
+    tmpdir.join('package/module.py').write('import sys\nimport os\n')
+
+    monkeypatch.setattr('sys.argv', ['isort', '--check-only', '--git-ref', 'HEAD', 'package'])
+    assert isort.main() == 1
+    assert capsys.readouterr()[0] == 'SUCCESS: package/other.py Everything Looks Good!\n'
+
+    monkeypatch.setattr('sys.argv', ['isort', '--check-only', '--staged', 'package'])
+    assert not isort.main()
+    assert capsys.readouterr()[0] == ('SUCCESS: package/module.py Everything Looks Good!\n'
+                                      'SUCCESS: package/other.py Everything Looks Good!\n')
+
+    monkeypatch.chdir(str(tmpdir.join('package')))
+    assert [file_name for file_name, _ in isort._git_sources(['.'], 'HEAD')] == ['data.txt', 'module.py',
+                                                                                 'other.py']
+    assert dict(isort._git_sources(['module.py']))['module.py'] == b'import os\nimport sys\n'
+    assert tmpdir.join('package/module.py').read() == 'import sys\nimport os\n'
+
+    monkeypatch.setattr('sys.argv', ['isort', '--check-only', '--git-ref', 'nosuchref', '.'])
+    assert isort.main() == 1
+    monkeypatch.setattr('sys.argv', ['isort', '--check-only', '--staged', '--shard', '1/2', '.'])
+    assert isort.main() == 1
+    monkeypatch.setattr('sys.argv', ['isort', '--check-only', '--staged', '--timeout', '0.000001', '.'])
+    monkeypatch.setattr(isort, '_clock', lambda clock=iter(range(0, 1000000, 1000)): next(clock))
+    assert isort.main() == 1
+
+
+def test_sort_range_within_strings():
+    """Test to ensure import-like lines within strings are never sorted when sorting a range of lines."""
+    test_input = ('def function():\n'
+                  '    """Example:\n'
+                  '\n'
+                  'import sys\n'
+                  'import os\n'
+                  '"""\n')
+    assert SortImports(file_contents=test_input).output == test_input
+    assert sort_range(test_input, 4) is None
+    assert sort_range(test_input, 4, 5) is None
+
+    with pytest.raises(ValueError):
+        sort_range(test_input, 5, 0)
+
+
+def test_sort_range_within_code():
+    """Test to ensure a range is only widened for multi-line imports, never back to an enclosing def or class."""
+    test_input = ('import os\n'
+                  '\n'
+                  '\n'
+                  'class MyClass(object):\n'
+                  '\n'
+                  '    def method(self):\n'
+                  '        x = 1\n'
+                  '        return x\n'
+                  'from lib import (lib2,\n'
+                  '    lib1)\n'
+                  'import sys\n')
+    assert sort_range(test_input, 7, 8) is None
+    assert sort_range(test_input, 8, 10) == SortedRange(8, 10, ('        return x\n'
+                                                               'from lib import lib1\n'
+                                                               'from lib import lib2\n'))
+    assert sort_range(test_input, 10, 11) == SortedRange(9, 11, ('import sys\n'
+                                                                '\n'
+                                                                'from lib import lib1\n'
+                                                                'from lib import lib2\n'))